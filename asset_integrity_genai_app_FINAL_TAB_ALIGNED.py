@@ -2,118 +2,193 @@ import streamlit as st
 
 import pandas as pd
 
-import random
+import numpy as np
 
-from datetime import datetime, timedelta
+import random
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
 
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 
 from dotenv import load_dotenv
 
+import io
 import os
+import time
+import threading
+from collections import OrderedDict
+import logging
+
+# Streamlit runs this file as __main__ and leaves its logger unconfigured, so give it
+# its own handler (once: the module body re-executes on every rerun)
+logger = logging.getLogger("asset_integrity_genai")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
 
 # Load API key from .env
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "sk-demo"))
+@st.cache_resource
+def get_client():
+    # One client (and keep-alive connection pool) shared by all sessions and reruns
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY", "sk-demo"),
+        max_retries=2,
+        timeout=30,
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_keepalive_connections=20))
+    )
 
-# --- Simulated Asset Register ---
+client = get_client()
 
-def generate_assets():
+MODEL_NAME = "gpt-3.5-turbo"
 
-    equipment_types = {
+STREAM_OPTIONS = {"include_usage": True}
 
-        "Pump": 30,
+# --- Simulated Asset Register ---
 
+@st.cache_data(show_spinner=False)
+def generate_assets(seed: int = 42):
+    rng = np.random.default_rng(seed)
+    equipment_types = {
+        "Pump": 30,
         "Compressor": 10,
-
         "Turbine": 5,
-
         "Heat Exchanger": 10,
-
         "Tank": 10,
-
         "Vessel": 5,
-
         "Pipeline": 15,
-
         "Motor": 10,
-
         "Control Panel": 5,
-
         "Sensor": 40
-
     }
-
-    assets = []
-
-    id_counter = 1
-
-    for eq_type, count in equipment_types.items():
-
-        for _ in range(count):
-
-            assets.append({
-
-                "Asset ID": f"A{id_counter:04d}",
-
-                "Type": eq_type,
-
-                "Location": f"Zone {random.choice(['A','B','C','D'])}",
-
-                "Age (years)": random.randint(1, 20),
-
-                "Last Maintenance": (datetime.today() - timedelta(days=random.randint(30, 900))).date(),
-
-                "Degradation %": round(random.uniform(10, 90), 2),
-
-                "Status": random.choice(["Operational", "Under Maintenance", "Standby"]),
-
-                "Vibration": round(random.uniform(0.1, 5.0), 2),
-
-                "Temperature": round(random.uniform(30, 120), 1),
-
-                "Corrosion Level": round(random.uniform(0, 1.0), 2),
-
-                "RUL (months)": random.randint(1, 36)
-
-            })
-
-            id_counter += 1
-
-    return pd.DataFrame(assets)
+    n = sum(equipment_types.values())
+    maintenance_age = pd.to_timedelta(rng.integers(30, 901, n), unit="D")
+    df = pd.DataFrame({
+        "Asset ID": pd.array([f"A{i:04d}" for i in range(1, n + 1)], dtype="string[pyarrow]"),
+        "Type": np.repeat(list(equipment_types.keys()), list(equipment_types.values())),
+        "Location": np.char.add("Zone ", rng.choice(["A", "B", "C", "D"], n)),
+        "Age (years)": rng.integers(1, 21, n, dtype=np.int16),
+        "Last Maintenance": (pd.Timestamp.today() - maintenance_age).date,
+        "Degradation %": np.round(rng.uniform(10, 90, n), 2),
+        "Status": rng.choice(["Operational", "Under Maintenance", "Standby"], n),
+        "Vibration": np.round(rng.uniform(0.1, 5.0, n), 2),
+        "Temperature": np.round(rng.uniform(30, 120, n), 1),
+        "Corrosion Level": np.round(rng.uniform(0, 1.0, n), 2),
+        "RUL (months)": rng.integers(1, 37, n, dtype=np.int16)
+    })
+    # Integer readings fit in int16; few-valued labels use int8 category codes
+    for col in ("Type", "Location", "Status"):
+        df[col] = df[col].astype("category")
+    return df
 
 assets_df = generate_assets()
 
-def genai_advisory(prompt):
-
+# Row selections shared by the lifespan, replacement cost and work order tabs;
+# the Styler callbacks derive their colours from the frame they are given
+_rul = assets_df["RUL (months)"].to_numpy()
+critical_mask, low_rul_mask = _rul <= 3, _rul <= 6
+
+ADVISORY_TTL = 3600
+ADVISORY_MAX_ENTRIES = 256
+
+def _log_usage(model, usage):
+    # Token counts per billed call; cache hits never reach here
+    if usage is not None:
+        logger.info("GenAI call: model=%s prompt_tokens=%s completion_tokens=%s",
+                    model, usage.prompt_tokens, usage.completion_tokens)
+
+def _messages(prompt):
+    return [
+        {"role": "system", "content": "You are an asset integrity advisor."},
+        {"role": "user", "content": prompt}
+    ]
+
+@st.cache_data(ttl=ADVISORY_TTL, max_entries=ADVISORY_MAX_ENTRIES, show_spinner=False)
+def _chat_completion(prompt: str, model: str) -> str:
+    response = client.chat.completions.create(model=model, messages=_messages(prompt))
+    _log_usage(model, response.usage)
+    return response.choices[0].message.content.strip()
+
+@st.cache_resource
+def _streamed_advisories():
+    # Finished streamed answers, shared across sessions like the st.cache_data entries:
+    # (prompt, model) -> (finished_at, answer), oldest first
+    return OrderedDict(), threading.Lock()
+
+def _recall_streamed(key):
+    cache, lock = _streamed_advisories()
+    with lock:
+        cached = cache.get(key)
+    if cached and time.monotonic() - cached[0] < ADVISORY_TTL:
+        return cached[1]
+    return None
+
+def _remember_streamed(key, advisory):
+    cache, lock = _streamed_advisories()
+    now = time.monotonic()
+    with lock:
+        cache[key] = (now, advisory)
+        cache.move_to_end(key)
+        # Entries are in insertion order, so expired and overflow entries are all at the front
+        while cache and (len(cache) > ADVISORY_MAX_ENTRIES
+                         or now - next(iter(cache.values()))[0] >= ADVISORY_TTL):
+            cache.popitem(last=False)
+
+def _stream_completion(prompt: str, model: str, render) -> str:
+    cached = _recall_streamed((prompt, model))
+    if cached is not None:
+        return cached
+    response = client.chat.completions.create(
+        model=model, messages=_messages(prompt), stream=True, stream_options=STREAM_OPTIONS
+    )
+    buf = []
+    for chunk in response:
+        # The final usage chunk carries no choices
+        if chunk.choices:
+            buf.append(chunk.choices[0].delta.content or "")
+            render("".join(buf))
+        if getattr(chunk, "usage", None):
+            _log_usage(model, chunk.usage)
+    advisory = "".join(buf).strip()
+    _remember_streamed((prompt, model), advisory)
+    return advisory
+
+def genai_advisory(prompt, render=None):
+    # Identical prompts are answered from the cache; errors are not cached.
+    # With render (e.g. st.empty().info) the answer is streamed in as it is generated.
     try:
-
-        response = client.chat.completions.create(
-
-            model="gpt-3.5-turbo",
-
-            messages=[
-
-                {"role": "system", "content": "You are an asset integrity advisor."},
-
-                {"role": "user", "content": prompt}
-
-            ]
-
-        )
-
-        return response.choices[0].message.content.strip()
-
+        if render is None:
+            return _chat_completion(prompt.strip(), MODEL_NAME)
+        advisory = _stream_completion(prompt.strip(), MODEL_NAME, render)
     except Exception as e:
-
-        return f"⚠️ GenAI Error: {e}"
+        advisory = f"⚠️ GenAI Error: {e}"
+    if render is not None:
+        render(advisory)
+    return advisory
+
+def genai_advisories(prompts):
+    # Independent prompts are sent concurrently: latency is the slowest call, not the sum
+    if not prompts:
+        return []
+    with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+        return list(executor.map(genai_advisory, prompts))
 
 st.set_page_config("Asset Integrity GenAI Assistant", layout="wide")
 
 st.title("🏭 Asset Integrity GenAI Assistant")
 
+# LLM calls only run on demand, and each session samples the same assets on every rerun
+# so repeated clicks hit the advisory cache instead of re-querying with a new asset
+if "sample_seed" not in st.session_state:
+    st.session_state.sample_seed = random.randrange(2**32)
+
 tabs = st.tabs(["📋 Overview", "🧱 Asset Register", "🔮 Lifespan Estimator", "🧪 Corrosion Simulator",
     "⚠️ Failure Mode Predictor", "🧠 Field Report Summarizer", "📜 Regulatory Watch",
     "💰 Replacement Cost Forecast", "🧰 Work Order Optimizer", "📸 Visual Fault Describer"])
@@ -154,23 +229,13 @@ with tabs[1]:
 
     st.subheader("🧱 Full Asset Register")
 
-    def color_row(row):
-
-        if row["RUL (months)"] <= 3:
-
-            return ['background-color: red'] * len(row)
-
-        elif row["RUL (months)"] <= 6:
-
-            return ['background-color: yellow'] * len(row)
-
-        else:
-
-            return ['background-color: lightgreen'] * len(row)
-
+    def color_all(df):
+        rul = df["RUL (months)"].to_numpy()
+        colors = np.where(rul <= 3, 'background-color: red',
+                 np.where(rul <= 6, 'background-color: yellow', 'background-color: lightgreen'))
+        return np.broadcast_to(colors[:, None], df.shape)
     st.markdown("**🟩 Green = Safe | 🟨 Yellow = Nearing Replacement | 🟥 Red = Immediate Replacement Required**")
-
-    styled_df = assets_df.style.apply(color_row, axis=1)
+    styled_df = assets_df.style.apply(color_all, axis=None)
 
     st.dataframe(styled_df, use_container_width=True)
 
@@ -178,21 +243,19 @@ with tabs[2]:
 
     st.subheader("🔮 Lifespan & Risk Estimator")
 
-    low_rul_df = assets_df[assets_df["RUL (months)"] <= 6]
+    low_rul_df = assets_df[low_rul_mask]
     st.markdown("**🟥 Red = Immediate Replacement | 🟨 Yellow = Nearing End of Life**")
-    def highlight_lifespan(row):
-        if row["RUL (months)"] <= 3:
-            return ["background-color: red"] * len(row)
-        elif row["RUL (months)"] <= 6:
-            return ["background-color: yellow"] * len(row)
-        else:
-            return [""] * len(row)
-    styled_lifespan = low_rul_df.style.apply(highlight_lifespan, axis=1)
+    def highlight_lifespan(df):
+        rul = df["RUL (months)"].to_numpy()
+        colors = np.where(rul <= 3, "background-color: red",
+                 np.where(rul <= 6, "background-color: yellow", ""))
+        return np.broadcast_to(colors[:, None], df.shape)
+    styled_lifespan = low_rul_df.style.apply(highlight_lifespan, axis=None)
     st.dataframe(styled_lifespan, use_container_width=True)
 
-    if not low_rul_df.empty:
+    if not low_rul_df.empty and st.button("Generate Lifespan Advisory"):
 
-        sample = low_rul_df.sample(1).iloc[0]
+        sample = low_rul_df.sample(1, random_state=st.session_state.sample_seed).iloc[0]
 
         prompt = f"""Asset ID: {sample['Asset ID']}
 
@@ -212,55 +275,69 @@ RUL: {sample['RUL (months)']} months
 
 Explain why this asset's RUL is low and suggest next steps."""
 
+        st.markdown(f"**GenAI Insight for {sample['Asset ID']}**")
         with st.spinner("Generating GenAI advisory..."):
+            genai_advisory(prompt, st.empty().info)
 
-            advisory = genai_advisory(prompt)
-
-            st.markdown(f"**GenAI Insight for {sample['Asset ID']}**")
-
-            st.info(advisory)
-
-with tabs[3]:
-
-    st.subheader("🧪 Corrosion Trend Simulator")
-
-    corroding = assets_df.sort_values("Corrosion Level", ascending=False).head(5)
-
-    import matplotlib.pyplot as plt
-
+@st.cache_data(show_spinner=False)
+def corrosion_png(series: pd.Series) -> bytes:
+    # Cache the rasterized PNG, not the Figure, so reruns skip savefig as well
     fig, ax = plt.subplots()
-
-    corroding_sorted = corroding.set_index('Asset ID')['Corrosion Level']
-
-    corroding_sorted.plot(kind='bar', ax=ax)
-
+    series.plot(kind='bar', ax=ax)
     ax.set_title('Top Corroding Assets')
-
     ax.set_xlabel('Asset ID')
-
     ax.set_ylabel('Corrosion Level')
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
 
-    st.pyplot(fig)
-
-    for _, row in corroding.iterrows():
-
-        st.markdown(f"**Corrosion Summary for {row['Asset ID']}**")
+with tabs[3]:
 
-        with st.spinner('Generating GenAI response...'):
+    st.subheader("🧪 Corrosion Trend Simulator")
 
-            st.warning(genai_advisory(prompt))
+    corroding = assets_df.nlargest(5, "Corrosion Level")
+
+    st.image(corrosion_png(corroding.set_index('Asset ID')['Corrosion Level']))
+
+    if st.button("Generate Corrosion Summaries"):
+        prompts = [
+            f"""Asset ID: {row['Asset ID']}
+Type: {row['Type']}
+Location: {row['Location']}
+Age: {row['Age (years)']} years
+Corrosion Level: {row['Corrosion Level']}
+Temperature: {row['Temperature']} deg C
+Explain the corrosion risk for this asset and recommend mitigation steps."""
+            for _, row in corroding.iterrows()
+        ]
+        with st.spinner('Generating GenAI responses...'):
+            advisories = genai_advisories(prompts)
+        for (_, row), advisory in zip(corroding.iterrows(), advisories):
+            st.markdown(f"**Corrosion Summary for {row['Asset ID']}**")
+            st.warning(advisory)
 
 with tabs[4]:
 
-    risky = assets_df.sort_values("Degradation %", ascending=False).head(5)
-
-    for _, row in risky.iterrows():
-
-        st.markdown(f"**Failure Mode Prediction for {row['Asset ID']}**")
-
-        with st.spinner('Generating GenAI response...'):
-
-            st.error(genai_advisory(prompt))
+    risky = assets_df.nlargest(5, "Degradation %")
+
+    if st.button("Predict Failure Modes"):
+        prompts = [
+            f"""Asset ID: {row['Asset ID']}
+Type: {row['Type']}
+Age: {row['Age (years)']} years
+Degradation: {row['Degradation %']}%
+Vibration: {row['Vibration']}
+Temperature: {row['Temperature']} deg C
+RUL: {row['RUL (months)']} months
+Predict the most likely failure modes for this asset and how to prevent them."""
+            for _, row in risky.iterrows()
+        ]
+        with st.spinner('Generating GenAI responses...'):
+            advisories = genai_advisories(prompts)
+        for (_, row), advisory in zip(risky.iterrows(), advisories):
+            st.markdown(f"**Failure Mode Prediction for {row['Asset ID']}**")
+            st.error(advisory)
 
 with tabs[5]:
 
@@ -272,67 +349,72 @@ with tabs[5]:
 
             prompt = f"Summarize this field report into risk advisory:\n{note}"
 
-            st.success(genai_advisory(prompt))
+            genai_advisory(prompt, st.empty().success)
 
 with tabs[6]:
 
     st.subheader("📜 Regulatory Compliance Forecast")
 
-    sample = assets_df.sample(1).iloc[0]
+    if st.button("Forecast Compliance Risks"):
+        sample = assets_df.sample(1, random_state=st.session_state.sample_seed).iloc[0]
 
-    prompt = f"The asset {sample['Asset ID']} is {sample['Age (years)']} years old with degradation {sample['Degradation %']}%, in location {sample['Location']}. Predict possible upcoming compliance risks."
+        prompt = f"The asset {sample['Asset ID']} is {sample['Age (years)']} years old with degradation {sample['Degradation %']}%, in location {sample['Location']}. Predict possible upcoming compliance risks."
 
-    with st.spinner("Evaluating regulatory risks..."):
+        with st.spinner("Evaluating regulatory risks..."):
 
-        st.info(genai_advisory(prompt))
+            genai_advisory(prompt, st.empty().info)
 
-def get_equipment_cost(eq_type):
+@st.cache_data(show_spinner=False)
+def _cost_catalog(seed: int = 42):
 
-    catalog = {
+    rng = random.Random(seed)
 
-        "Pump": random.randint(5000, 15000),
+    return pd.Series({
 
-        "Compressor": random.randint(20000, 60000),
+        "Pump": rng.randint(5000, 15000),
 
-        "Turbine": random.randint(40000, 120000),
+        "Compressor": rng.randint(20000, 60000),
 
-        "Tank": random.randint(15000, 40000),
+        "Turbine": rng.randint(40000, 120000),
 
-        "Sensor": random.randint(500, 3000),
+        "Tank": rng.randint(15000, 40000),
 
-        "Pipeline": random.randint(10000, 30000),
+        "Sensor": rng.randint(500, 3000),
 
-        "Motor": random.randint(8000, 20000),
+        "Pipeline": rng.randint(10000, 30000),
 
-        "Control Panel": random.randint(5000, 15000),
+        "Motor": rng.randint(8000, 20000),
 
-        "Heat Exchanger": random.randint(10000, 25000),
+        "Control Panel": rng.randint(5000, 15000),
 
-        "Vessel": random.randint(12000, 35000)
+        "Heat Exchanger": rng.randint(10000, 25000),
 
-    }
+        "Vessel": rng.randint(12000, 35000)
+
+    })
 
-    return catalog.get(eq_type, 10000)
+COST_CATALOG = _cost_catalog()
 
 with tabs[7]:
 
-    low_rul = assets_df[assets_df["RUL (months)"] <= 6]
+    low_rul = assets_df.loc[low_rul_mask].copy()
 
     if not low_rul.empty:
 
-        low_rul["Replacement Cost ($)"] = low_rul["Type"].apply(get_equipment_cost)
+        low_rul["Replacement Cost ($)"] = low_rul["Type"].map(COST_CATALOG).astype("float64").fillna(10000).astype("int32")
 
-        low_rul["Replace By"] = pd.to_datetime('today') + pd.to_timedelta(low_rul["RUL (months)"] * 30, unit='D')
+        low_rul["Replace By"] = np.datetime64(pd.Timestamp.today().date(), 'D') + (low_rul["RUL (months)"].to_numpy().astype('int32') * 30).astype('timedelta64[D]')
 
         st.dataframe(low_rul[["Asset ID", "Type", "Location", "RUL (months)", "Replacement Cost ($)", "Replace By"]])
 
         total = low_rul["Replacement Cost ($)"].sum()
 
-        prompt = f"In the next 6 months, assets totaling ${total} are due for replacement. Provide a capital planning summary."
+        if st.button("Generate Capital Planning Advisory"):
+            prompt = f"In the next 6 months, assets totaling ${total} are due for replacement. Provide a capital planning summary."
 
-        with st.spinner("Generating GenAI replacement cost advisory..."):
+            with st.spinner("Generating GenAI replacement cost advisory..."):
 
-            st.success(genai_advisory(prompt))
+                genai_advisory(prompt, st.empty().success)
 
     else:
 